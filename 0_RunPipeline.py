@@ -0,0 +1,210 @@
+import argparse
+import hashlib
+import importlib
+import json
+import os
+from pathlib import Path
+from shards import INDEX_FILE_NAME, ShardReader
+
+generate_reduced_dataset = importlib.import_module('1_GenerateReducedDataset')
+filter_files_by_json = importlib.import_module('2_FilterFilesByJson')
+rebuild_json_from_existing_files = importlib.import_module('3_RebuildJsonFromExistingFiles')
+annotate_image = importlib.import_module('4_AnnotateImage')
+check_file_cnt_json = importlib.import_module('5_CheckFileCntJson')
+
+STAGE_NAMES = {
+    1: 'GenerateReducedDataset',
+    2: 'FilterFilesByJson',
+    3: 'RebuildJsonFromExistingFiles',
+    4: 'AnnotateImage',
+    5: 'CheckFileCntJson',
+}
+
+
+class Pipeline:
+    """ Runs a sequence of the numbered scripts as stages of one process
+
+        Every json file is parsed at most once and every folder is listed at most once, loaded datasets and file
+        listings are handed from stage to stage in memory. The inputs of every stage are fingerprinted in
+        <input>_pipeline.json, a stage whose inputs did not change since its last run is skipped.
+    """
+
+    def __init__(self, console_args):
+        self.args = console_args
+        self.stages = [int(stage) for stage in console_args.stages.split(',')]
+        for stage in self.stages:
+            if stage not in STAGE_NAMES:
+                print('Unknown stage: ' + str(stage))
+                print('Quitting early.')
+                quit()
+
+        if not Path(console_args.input_json).exists():
+            print('Input json path not found.')
+            print('Quitting early.')
+            quit()
+
+        if not Path(console_args.input_image_path).exists():
+            print('Input image path not found.')
+            print('Quitting early.')
+            quit()
+
+        self.input_json_path = Path(console_args.input_json)
+        self.input_image_path = Path(console_args.input_image_path)
+
+        # same output locations the scripts use on their own
+        size = len(str(self.input_json_path))
+        self.reduced_json_path = Path(str(self.input_json_path)[:size - 5] + '_reduced.json')
+        self.rebuilt_json_path = Path(str(self.input_json_path)[:size - 5] + '_reduced_rebuilt.json')
+        self.reduced_image_path = self.input_image_path.parent / (self.input_image_path.name + '_reduced')
+        self.state_path = Path(str(self.input_json_path)[:size - 5] + '_pipeline.json')
+
+        # stages after 1 work on the reduced json, stages after 3 on the rebuilt one
+        self.current_json_path = self.reduced_json_path
+        self.datasets = dict()
+        self.listings = dict()
+        self.shards = console_args.export_format == 'shards'
+
+    def main(self):
+        state = dict()
+        if self.state_path.exists():
+            with open(self.state_path) as state_file:
+                state = json.load(state_file)
+
+        for stage in self.stages:
+            name = str(stage) + '_' + STAGE_NAMES[stage]
+            fingerprint = self._fingerprint(stage)
+            previous = state.get(str(stage), dict())
+            if previous.get('fingerprint') == fingerprint and self._outputs_exist(stage):
+                print('Skipping ' + name + ', its inputs did not change.')
+                if stage == 5:
+                    print(str(previous['image_cnt']) + " images found in json file")
+                self._skip_stage(stage)
+                continue
+
+            print('Running ' + name + '...')
+            state[str(stage)] = self._run_stage(stage)
+            state[str(stage)]['fingerprint'] = fingerprint
+            with open(self.state_path, 'w') as state_file:
+                json.dump(state, state_file)
+
+    def _dataset(self, path):
+        if path not in self.datasets:
+            print('Loading ' + str(path) + '...')
+            with open(path) as json_file:
+                self.datasets[path] = json.load(json_file)
+        return self.datasets[path]
+
+    def _listing(self, folder):
+        if folder not in self.listings:
+            self.listings[folder] = set()
+            if folder.exists():
+                self.listings[folder] = {entry.name for entry in os.scandir(folder) if entry.is_file()}
+        return self.listings[folder]
+
+    def _stored_files(self):
+        """ File names of the images in the reduced folder, with shards the ones whose id is packed
+        """
+        if not self.shards:
+            return self._listing(self.reduced_image_path)
+        if not (self.reduced_image_path / INDEX_FILE_NAME).exists():
+            return set()
+        reader = ShardReader(self.reduced_image_path)
+        stored = {image['file_name'] for image in self._dataset(self.current_json_path)['images']
+                  if image['id'] in reader}
+        reader.close()
+        return stored
+
+    def _file_state(self, path):
+        if not path.exists():
+            return None
+        stat = path.stat()
+        return [str(path), stat.st_size, stat.st_mtime_ns]
+
+    def _folder_state(self, folder):
+        return hashlib.sha1('\n'.join(sorted(self._listing(folder))).encode()).hexdigest()
+
+    def _fingerprint(self, stage):
+        if stage == 1:
+            parameters = {key: value for key, value in vars(self.args).items() if key != 'stages'}
+            return [parameters, self._file_state(self.input_json_path), self._folder_state(self.input_image_path)]
+        if stage == 2:
+            return [self._file_state(self.current_json_path), self._folder_state(self.input_image_path)]
+        if stage == 3:
+            return [self._file_state(self.current_json_path), self._folder_state(self.reduced_image_path)]
+        return [self._file_state(self.current_json_path), self._folder_state(self.reduced_image_path)]
+
+    def _outputs_exist(self, stage):
+        if stage == 1:
+            return self.reduced_json_path.exists()
+        if stage == 2:
+            return self.reduced_image_path.exists()
+        if stage == 3:
+            return self.rebuilt_json_path.exists()
+        if stage == 4:
+            return (self.reduced_image_path / 'labeled').exists()
+        return True
+
+    def _skip_stage(self, stage):
+        if stage == 3:
+            self.current_json_path = self.rebuilt_json_path
+
+    def _run_stage(self, stage):
+        """ Runs one stage on the in-memory data and returns what has to be remembered about the run
+        """
+        if stage == 1:
+            cf = generate_reduced_dataset.CocoFilter(self.args, json_file=self._dataset(self.input_json_path))
+            cf.main()
+            self.datasets[self.reduced_json_path] = cf.new_master_json
+            # the reduced folder was cleared and refilled
+            self.listings.pop(self.reduced_image_path, None)
+            if self.args.export_format == 'files':
+                self.listings[self.reduced_image_path] = {image['file_name'] for image in cf.new_images}
+            return dict()
+
+        if stage == 2:
+            if self.shards and 1 in self.stages:
+                print('Images were already packed by stage 1.')
+                return dict()
+            folder, copied = filter_files_by_json.filter_files(self._dataset(self.current_json_path),
+                                                               self.input_image_path, shards=self.shards,
+                                                               max_shard_mb=self.args.max_shard_mb,
+                                                               existing_files=self._listing(self.reduced_image_path))
+            if self.shards:
+                self.listings.pop(self.reduced_image_path, None)
+            else:
+                self.listings[self.reduced_image_path] |= copied
+            return dict()
+
+        if stage == 3:
+            paths = argparse.Namespace(image_path=self.reduced_image_path, input_json=self.current_json_path,
+                                       output_json=self.rebuilt_json_path)
+            cf = rebuild_json_from_existing_files.CocoFilter(paths, json_file=self._dataset(self.current_json_path),
+                                                             existing_files=self._stored_files())
+            cf.main()
+            self.current_json_path = self.rebuilt_json_path
+            self.datasets[self.rebuilt_json_path] = cf.new_master_json
+            return dict()
+
+        if stage == 4:
+            if self.shards:
+                print('Annotating needs image files, skipped with --export_format shards.')
+                return dict()
+            annotate_image.annotate_images(self._dataset(self.current_json_path), self.reduced_image_path,
+                                           self.args.queue_depth, self.args.max_buffer_mb,
+                                           existing_files=self._listing(self.reduced_image_path))
+            return dict()
+
+        image_cnt = check_file_cnt_json.count_images(self._dataset(self.current_json_path))
+        print(str(image_cnt) + " images found in json file")
+        return {'image_cnt': image_cnt}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    generate_reduced_dataset.add_arguments(parser)
+    parser.add_argument("--stages", default="1,2,3,5",
+                        help="comma separated numbers of the scripts to run in this order, e.g. 1,2,3,5,4")
+    args = parser.parse_args()
+    pipeline = Pipeline(args)
+    pipeline.main()
+    # example call: python 0_RunPipeline.py -i /d/ThesisData/coco/annotations/person_keypoints_train2017.json -p /d/ThesisData/coco/images/train2017/ -c 100000 -k 12 -t 120 -u 30 --stages 1,2,3,5,4
@@ -12,33 +12,72 @@ import argparse
 import json
 import shutil
 from pathlib import Path
+from image_io import ImagePrefetcher
+from shards import ShardWriter
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument("-i", "--input_json", dest="input_json", help="path to a json file in coco format")
-    parser.add_argument("-p", "--input_image_path", dest="input_image_path", help="path to image folder")
-    args = parser.parse_args()
-    json_path = Path(args.input_json)
-    imgs_path = Path(args.input_image_path)
 
-    imgs = []
+def filter_files(data, imgs_path, shards=False, max_shard_mb=1024, existing_files=None):
+    """ Copies (or packs) the images of a loaded coco json into <image folder>_reduced
+        Files listed in existing_files are already in the target folder and are not copied again.
+        Returns the target folder and the names of the files copied into it.
+    """
+    imgs_path = Path(imgs_path)
     files = []
+    ids = []
+    annotations = dict()
     cnt = 0
 
-    with open(json_path) as json_file:
-        data = json.load(json_file)
-        for i in data['images']:
-            files.append(i['file_name'])
+    for i in data['images']:
+        files.append(i['file_name'])
+        ids.append(i['id'])
+    for a in data['annotations']:
+        annotations.setdefault(a['image_id'], []).append(a)
 
     print(str(len(files)) + " images found")
     folder = os.path.join(imgs_path.parent, imgs_path.name + "_reduced")
     if not os.path.exists(folder):
         os.mkdir(folder)
+
+    if shards:
+        paths = (os.path.join(imgs_path, f) for f in files)
+        with ShardWriter(folder, max_shard_mb) as writer, ImagePrefetcher(paths) as prefetcher:
+            for id, image_data in zip(ids, prefetcher):
+                writer.add(id, image_data, annotations.get(id, []))
+                cnt += 1
+                if cnt % 500 == 0:
+                    print(str(cnt) + " images packed")
+
+        print(str(cnt) + " images packed")
+        return folder, set()
+
+    copied = set()
     for f in files:
+        if existing_files is not None and f in existing_files:
+            continue
         shutil.copy(os.path.join(imgs_path, f),
                     os.path.join(folder, f))
+        copied.add(f)
         cnt += 1
         if cnt % 500 == 0:
             print(str(cnt) + " images copied")
 
     print(str(cnt) + " images copied")
+    return folder, copied
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input_json", dest="input_json", help="path to a json file in coco format")
+    parser.add_argument("-p", "--input_image_path", dest="input_image_path", help="path to image folder")
+    parser.add_argument("-s", "--shards", action="store_true",
+                        help="pack the images with their annotations into shard files instead of copying them")
+    parser.add_argument("--max_shard_mb", type=int, default=1024,
+                        help="size in MB after which a new shard file is started")
+    args = parser.parse_args()
+    json_path = Path(args.input_json)
+    imgs_path = Path(args.input_image_path)
+
+    with open(json_path) as json_file:
+        data = json.load(json_file)
+
+    filter_files(data, imgs_path, args.shards, args.max_shard_mb)
@@ -9,18 +9,20 @@ class CocoFilter:
     """ Filters the COCO dataset (info, licenses, images, annotations, categories) and generates a new, filtered json file
     """
 
-    def __init__(self, paths):
+    def __init__(self, paths, json_file=None, existing_files=None):
         self.filter_for_categories = ['person']
+        # names of the files in image_path if they are already known, otherwise every file is looked up
+        self.existing_files = existing_files
 
         # Verify image path exists
         if not Path(paths.image_path).exists():
             print('Image path not found.')
             print('Quitting early.')
             quit()
-        self.image_path = Path(args.image_path)
+        self.image_path = Path(paths.image_path)
 
         # Verify input path exists
-        if not Path(paths.input_json).exists():
+        if json_file is None and not Path(paths.input_json).exists():
             print('Input json path not found.')
             print('Quitting early.')
             quit()
@@ -34,9 +36,12 @@ class CocoFilter:
                 quit()
         self.output_json_path = Path(paths.output_json)
 
-        print('Loading json file...')
-        with open(self.input_json_path) as json_file:
-            self.jsonFile = json.load(json_file)
+        if json_file is not None:
+            self.jsonFile = json_file
+        else:
+            print('Loading json file...')
+            with open(self.input_json_path) as json_file:
+                self.jsonFile = json.load(json_file)
 
     def _generate_info(self):
         today = date.today()
@@ -122,7 +127,7 @@ class CocoFilter:
         self.new_annotations = []
         self.new_image_ids = set()
         for image_id, annotation_list in self.annotations.items():
-            if os.path.isfile(os.path.join(self.image_path, self.images[image_id]['file_name'])):
+            if self._image_exists(self.images[image_id]['file_name']):
                 for annotation in annotation_list:
                     original_seg_cat = annotation['category_id']
                     new_annotation = dict(annotation)
@@ -133,6 +138,11 @@ class CocoFilter:
         print("New annotation count: " + str(len(self.new_annotations)))
 
 
+    def _image_exists(self, file_name):
+        if self.existing_files is not None:
+            return file_name in self.existing_files
+        return os.path.isfile(os.path.join(self.image_path, file_name))
+
     def _filter_images(self):
         """ Create new collection of images
         """
@@ -155,7 +165,7 @@ class CocoFilter:
         self._filter_images()
 
         # Build new JSON
-        new_master_json = {
+        self.new_master_json = {
             'info': self.info,
             'images': self.new_images,
             'annotations': self.new_annotations,
@@ -165,7 +175,7 @@ class CocoFilter:
         # Write the JSON to a file
         print('Saving new json file...')
         with open(self.output_json_path, 'w+') as output_file:
-            json.dump(new_master_json, output_file)
+            json.dump(self.new_master_json, output_file)
 
         print('Filtered json saved.')
 
@@ -4,30 +4,27 @@ import os
 import cv2
 from pathlib import Path
 import sqlite3
+from image_io import ImagePrefetcher, decode_image
 
 conn = sqlite3.connect(':memory:')
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument("-i", "--input_json", dest="input_json", help="path to a json file in coco format")
-    parser.add_argument("-p", "--input_image_path", dest="input_image_path", help="path to image folder")
-    args = parser.parse_args()
-    json_path = Path(args.input_json)
-    imgs_path = Path(args.input_image_path)
 
+def annotate_images(data, imgs_path, queue_depth=16, max_buffer_mb=256, existing_files=None):
+    """ Draws the keypoints of a loaded coco json into its images and writes them to <image folder>/labeled
+        Files listed in existing_files are the images known to exist, otherwise every file is looked up.
+    """
+    imgs_path = Path(imgs_path)
     id_to_file = dict()
     id_to_annot = dict()
 
-    with open(json_path) as json_file:
-        data = json.load(json_file)
-        for img in data['images']:
-            id_to_file[int(img['id'])] = img['file_name']
+    for img in data['images']:
+        id_to_file[int(img['id'])] = img['file_name']
 
-        for annot in data['annotations']:
-            key = int(annot['image_id'])
-            if key not in id_to_annot:
-                id_to_annot[key] = []
-            id_to_annot[key].append(annot['keypoints'])
+    for annot in data['annotations']:
+        key = int(annot['image_id'])
+        if key not in id_to_annot:
+            id_to_annot[key] = []
+        id_to_annot[key].append(annot['keypoints'])
 
     file_to_annot = dict()
     for key in id_to_file.keys():
@@ -37,11 +34,20 @@ if __name__ == "__main__":
     del id_to_file
     del id_to_annot
 
+    if existing_files is None:
+        files = [file for file in file_to_annot.keys() if os.path.exists(os.path.join(imgs_path, file))]
+    else:
+        files = [file for file in file_to_annot.keys() if file in existing_files]
+    paths = (str(os.path.join(imgs_path, file)) for file in files)
+
     cnt = 0
-    for file in file_to_annot.keys():
-        path = str(os.path.join(imgs_path, file))
-        if os.path.exists(path):
-            img = cv2.imread(path)
+    skipped = 0
+    with ImagePrefetcher(paths, queue_depth, max_buffer_mb) as prefetcher:
+        for file, image_data in zip(files, prefetcher):
+            img = decode_image(image_data)
+            if img is None:
+                skipped += 1
+                continue
 
             for annot in file_to_annot[file]:
                 keypoints_x = annot[::3]
@@ -71,3 +77,23 @@ if __name__ == "__main__":
                 print(str(cnt) + " images annotated")
 
     print(str(cnt) + " images annotated")
+    if skipped > 0:
+        print(str(skipped) + " images skipped because they can not be decoded")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input_json", dest="input_json", help="path to a json file in coco format")
+    parser.add_argument("-p", "--input_image_path", dest="input_image_path", help="path to image folder")
+    parser.add_argument("--queue_depth", type=int, default=16,
+                        help="number of image files read ahead while the current one is decoded")
+    parser.add_argument("--max_buffer_mb", type=int, default=256,
+                        help="read ahead pauses while this many MB of read image files are waiting to be decoded")
+    args = parser.parse_args()
+    json_path = Path(args.input_json)
+    imgs_path = Path(args.input_image_path)
+
+    with open(json_path) as json_file:
+        data = json.load(json_file)
+
+    annotate_images(data, imgs_path, args.queue_depth, args.max_buffer_mb)
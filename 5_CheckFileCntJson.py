@@ -7,6 +7,21 @@ import sqlite3
 
 conn = sqlite3.connect(':memory:')
 
+
+def count_images(data):
+    """ Number of images of a loaded coco json which have at least one annotation
+    """
+    image_ids = set()
+    for img in data['images']:
+        image_ids.add(int(img['id']))
+
+    annotated_ids = set()
+    for annot in data['annotations']:
+        annotated_ids.add(int(annot['image_id']))
+
+    return len(image_ids & annotated_ids)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-j", dest="json_path")
@@ -16,18 +31,4 @@ if __name__ == "__main__":
     with open(json_path) as json_file:
         data = json.load(json_file)
 
-        i = 0
-        j = 0
-        for img in data['images']:
-            i += 1
-        for annot in data['annotations']:
-            ids = list()
-            id = int(annot['image_id'])
-            if id not in ids:
-                j += 1
-            ids.append(id)
-
-    if i <= j:
-        print(str(i) + " images found in json file")
-    else:
-        print(str(j) + " images found in json file")
+    print(str(count_images(data)) + " images found in json file")
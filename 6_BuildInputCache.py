@@ -0,0 +1,41 @@
+import argparse
+import json
+import os
+from pathlib import Path
+from input_cache import build_input_cache
+from shards import ShardReader
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input_json", dest="input_json", help="path to a json file in coco format")
+    parser.add_argument("-p", "--input_image_path", dest="input_image_path",
+                        help="path to image folder, or to a shard folder written with --export_format shards")
+    parser.add_argument("-o", "--output_path", dest="output_path", default=None,
+                        help="folder of the cache, defaults to <image folder>_input_cache")
+    parser.add_argument("--scale_factor", type=float, default=1.0, help="scale factor applied before the network")
+    parser.add_argument("--output_stride", type=int, default=16, help="output stride of the network")
+    parser.add_argument("--dtype", choices=["float16", "uint8"], default="float16",
+                        help="float16 stores normalized inputs, uint8 stores RGB values normalized when read")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of preprocessing threads")
+    args = parser.parse_args()
+    json_path = Path(args.input_json)
+    imgs_path = Path(args.input_image_path)
+
+    output_path = args.output_path
+    if output_path is None:
+        output_path = os.path.join(imgs_path.parent, imgs_path.name + "_input_cache")
+
+    with open(json_path) as json_file:
+        data = json.load(json_file)
+    print(str(len(data['images'])) + " images found")
+
+    load_image_data = None
+    if (imgs_path / 'index.npy').exists():
+        shard_reader = ShardReader(imgs_path)
+
+        def load_image_data(image):
+            return shard_reader.image_data(image['id'])
+
+    build_input_cache(data['images'], imgs_path, output_path, args.scale_factor, args.output_stride, args.dtype,
+                      args.workers, load_image_data)
+    print("Input cache saved to " + str(output_path))
@@ -0,0 +1,321 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from datetime import date
+from image_io import read_file
+
+JSON_WHITESPACE = ' \t\r\n'
+JSON_NUMBER_CHARS = '0123456789+-.eE'
+# everything up to the next bracket of one kind which is not inside a string, strings are consumed as a whole
+SKIP_PATTERNS = {
+    '[': re.compile(r'(?:[^"\[\]]+|"[^"\\]*(?:\\.[^"\\]*)*")*'),
+    '{': re.compile(r'(?:[^"{}]+|"[^"\\]*(?:\\.[^"\\]*)*")*'),
+}
+
+
+class JsonStream:
+    """ Walks the top level object of a json file without loading it completely
+
+        items() yields (key, value) for every top level entry, except that lists are yielded element by element as
+        (key, element). Only one element has to fit into memory at a time. Values of keys which are not in the given
+        keys are skipped by matching brackets, without decoding them.
+    """
+
+    def __init__(self, path, chunk_size=1 << 20):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        data = self.file.read(self.chunk_size)
+        if not data:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in JSON_WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError('Expected ' + char + ' at offset ' + str(self.pos) + ' of ' + str(self.path))
+        self.pos += 1
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # a number at the end of the buffer may continue in the next chunk, '3.' decodes as 3
+                if self.eof or end < len(self.buffer) and self.buffer[end] not in JSON_NUMBER_CHARS:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def _skip(self):
+        opening = self._peek()
+        if opening not in SKIP_PATTERNS:
+            self._value()
+            return
+        pattern = SKIP_PATTERNS[opening]
+        depth = 0
+        while True:
+            self.pos = pattern.match(self.buffer, self.pos).end()
+            # the match stops early at a string which continues in the next chunk
+            if self.pos == len(self.buffer) or self.buffer[self.pos] == '"':
+                if not self._fill():
+                    raise ValueError('Unexpected end of ' + str(self.path))
+                continue
+            depth += 1 if self.buffer[self.pos] == opening else -1
+            self.pos += 1
+            if depth == 0:
+                return
+
+    def items(self, keys=None):
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        with open(self.path) as self.file:
+            self._expect('{')
+            while self._peek() != '}':
+                key = self._value()
+                self._expect(':')
+                if keys is not None and key not in keys:
+                    self._skip()
+                elif self._peek() == '[':
+                    self._expect('[')
+                    while self._peek() != ']':
+                        yield key, self._value()
+                        if self._peek() == ',':
+                            self._expect(',')
+                    self._expect(']')
+                else:
+                    yield key, self._value()
+                if self._peek() == ',':
+                    self._expect(',')
+
+
+class CocoMerger:
+    """ Merges several COCO keypoint json files into one with bounded memory
+
+        Images are streamed in a first pass over all files, annotations in a second one, and both are written to
+        the output as they are read. Duplicate images are detected by file name or by a hash of the image file.
+        Image, annotation and category ids are renumbered, so ids of different files can not collide. A file name
+        which is already taken by a different image is prefixed with the index of its input json, and with image
+        paths every image entry records the folder and file name it came from. --output_image_path copies the merged
+        images under their new file names into one folder.
+    """
+
+    def __init__(self, console_args):
+        self.input_json_paths = [Path(path) for path in console_args.input_json]
+        for path in self.input_json_paths:
+            if not path.exists():
+                print('Input json path not found: ' + str(path))
+                print('Quitting early.')
+                quit()
+
+        self.dedup = console_args.dedup
+        self.image_paths = [Path(path) for path in console_args.image_path or []]
+        if self.dedup == 'hash' and len(self.image_paths) != len(self.input_json_paths):
+            print('Deduplication by hash needs one image path per input json.')
+            print('Quitting early.')
+            quit()
+
+        # Verify output path does not already exist
+        if Path(console_args.output_json).exists():
+            should_continue = input('Output path already exists. Overwrite? (y/n) ').lower()
+            if should_continue != 'y' and should_continue != 'yes':
+                print('Quitting early.')
+                quit()
+        self.output_json_path = Path(console_args.output_json)
+        self.workers = console_args.workers
+
+        self.output_image_path = console_args.output_image_path
+        if self.output_image_path is not None and len(self.image_paths) != len(self.input_json_paths):
+            print('Copying the merged images needs one image path per input json.')
+            print('Quitting early.')
+            quit()
+        if self.output_image_path is not None and not os.path.exists(self.output_image_path):
+            os.mkdir(self.output_image_path)
+
+    def main(self):
+        self.info = None
+        self.licenses = []
+        self.categories = []
+        self.category_ids = dict()
+        self.category_id_maps = []
+        self.image_id_maps = []
+        self.seen_images = dict()
+        self.file_names = set()
+
+        with open(self.output_json_path, 'w') as self.output_file:
+            self.output_file.write('{"images": [')
+            self.first_item = True
+            for file_index, path in enumerate(self.input_json_paths):
+                print('Merging images of ' + str(path) + '...')
+                self._merge_images(file_index, path)
+
+            self.output_file.write('], "annotations": [')
+            self.first_item = True
+            self.annotation_cnt = 0
+            for file_index, path in enumerate(self.input_json_paths):
+                print('Merging annotations of ' + str(path) + '...')
+                self._merge_annotations(file_index, path)
+
+            self._generate_info()
+            self.output_file.write('], "categories": ' + json.dumps(self.categories))
+            self.output_file.write(', "info": ' + json.dumps(self.info))
+            self.output_file.write(', "licenses": ' + json.dumps(self.licenses) + '}')
+
+        print("Merged image count: " + str(len(self.seen_images)))
+        print("Merged annotation count: " + str(self.annotation_cnt))
+        print('Merged json saved.')
+
+    def _generate_info(self):
+        today = date.today()
+        self.info = dict(self.info or {})
+        self.info['description'] = 'Merged COCO keypoint dataset'
+        self.info['date_created'] = today.strftime("%Y/%m/%d")
+
+    def _write_item(self, item):
+        if not self.first_item:
+            self.output_file.write(', ')
+        self.output_file.write(json.dumps(item))
+        self.first_item = False
+
+    def _process_categories(self, file_index, category):
+        """ Categories are matched by name and get the id of their first occurrence in the merged json
+        """
+        name = category['name']
+        if name not in self.category_ids:
+            new_category = dict(category)
+            new_category['id'] = len(self.categories) + 1
+            self.categories.append(new_category)
+            self.category_ids[name] = new_category['id']
+        self.category_id_maps[file_index][category['id']] = self.category_ids[name]
+
+    def _image_keys(self, file_index, images):
+        if self.dedup == 'file_name':
+            return [image['file_name'] for image in images]
+
+        def hash_file(image):
+            return hashlib.sha1(read_file(os.path.join(self.image_paths[file_index], image['file_name']))).hexdigest()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(hash_file, images))
+
+    def _unique_file_name(self, file_index, file_name):
+        """ Different images with the same file name occur with --dedup hash, later ones get a prefix
+        """
+        new_file_name = file_name
+        cnt = 0
+        while new_file_name in self.file_names:
+            cnt += 1
+            new_file_name = str(file_index) + ('_' + str(cnt) if cnt > 1 else '') + '_' + file_name
+        self.file_names.add(new_file_name)
+        return new_file_name
+
+    def _copy_images(self, file_index, images):
+        def copy(image):
+            shutil.copyfile(os.path.join(self.image_paths[file_index], image['source_file_name']),
+                            os.path.join(self.output_image_path, image['file_name']))
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for _ in executor.map(copy, images):
+                pass
+
+    def _merge_image_batch(self, file_index, images):
+        image_id_map = self.image_id_maps[file_index]
+        duplicates = 0
+        new_images = []
+        for image, key in zip(images, self._image_keys(file_index, images)):
+            if key in self.seen_images:
+                # annotations of duplicates are dropped, the first occurrence keeps its own
+                image_id_map[image['id']] = None
+                duplicates += 1
+                continue
+            new_image = dict(image)
+            new_image['id'] = len(self.seen_images) + 1
+            new_image['file_name'] = self._unique_file_name(file_index, image['file_name'])
+            if self.image_paths:
+                new_image['source_image_path'] = str(self.image_paths[file_index])
+                new_image['source_file_name'] = image['file_name']
+            self.seen_images[key] = new_image['id']
+            image_id_map[image['id']] = new_image['id']
+            self._write_item(new_image)
+            new_images.append(new_image)
+
+        if self.output_image_path is not None:
+            self._copy_images(file_index, new_images)
+        return duplicates
+
+    def _merge_images(self, file_index, path, batch_size=1000):
+        self.image_id_maps.append(dict())
+        self.category_id_maps.append(dict())
+        duplicates = 0
+        batch = []
+        for key, value in JsonStream(path).items(keys=('images', 'categories', 'info', 'licenses')):
+            if key == 'images':
+                batch.append(value)
+                if len(batch) >= batch_size:
+                    duplicates += self._merge_image_batch(file_index, batch)
+                    batch = []
+            elif key == 'categories':
+                self._process_categories(file_index, value)
+            elif key == 'info' and self.info is None:
+                self.info = value
+            elif key == 'licenses' and value not in self.licenses:
+                self.licenses.append(value)
+        duplicates += self._merge_image_batch(file_index, batch)
+        print(str(duplicates) + " duplicate images skipped")
+
+    def _merge_annotations(self, file_index, path):
+        """ Annotations of skipped duplicate images are dropped
+        """
+        image_id_map = self.image_id_maps[file_index]
+        category_id_map = self.category_id_maps[file_index]
+        for key, annotation in JsonStream(path).items(keys=('annotations',)):
+            new_image_id = image_id_map.get(annotation['image_id'])
+            if new_image_id is None:
+                continue
+            new_annotation = dict(annotation)
+            self.annotation_cnt += 1
+            new_annotation['id'] = self.annotation_cnt
+            new_annotation['image_id'] = new_image_id
+            new_annotation['category_id'] = category_id_map[annotation['category_id']]
+            self._write_item(new_annotation)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--input_json", dest="input_json", nargs='+',
+                        help="paths to json files in coco format, earlier files win on duplicates")
+    parser.add_argument("-o", "--output_json", dest="output_json", help="path to save the merged json")
+    parser.add_argument("-p", "--image_path", dest="image_path", nargs='*',
+                        help="image folder of every input json, needed for --dedup hash and --output_image_path")
+    parser.add_argument("--output_image_path", default=None,
+                        help="folder to copy the images of the merged json into, under their merged file names")
+    parser.add_argument("--dedup", choices=["file_name", "hash"], default="file_name",
+                        help="detect duplicate images by file name or by a hash of the image file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of threads hashing image files")
+    args = parser.parse_args()
+
+    cm = CocoMerger(args)
+    cm.main()
+    # example call: python 7_MergeDatasets.py -i person_keypoints_train2017.json person_keypoints_val2017.json -o person_keypoints_merged.json
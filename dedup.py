@@ -0,0 +1,58 @@
+import cv2
+import numpy as np
+
+
+def perceptual_hash(img, hash_size=8):
+    """ 64 bit DCT based perceptual hash of a decoded BGR image
+        Bits are set where the low frequency DCT coefficients of the downscaled grayscale image exceed their median
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(gray, (hash_size * 4, hash_size * 4), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low_freq = cv2.dct(small)[:hash_size, :hash_size]
+    bits = (low_freq > np.median(low_freq)).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming_distance(hash_a, hash_b):
+    return bin(hash_a ^ hash_b).count('1')
+
+
+def _popcount(values):
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    # numpy < 2.0, count the set bits of every byte with a lookup table
+    return BYTE_POPCOUNT[values.view(np.uint8)].reshape(len(values), 8).sum(axis=1)
+
+
+BYTE_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+class HashIndex:
+    """ Perceptual hashes of the kept images in one growing uint64 array
+
+        A lookup XORs the query with all indexed hashes and counts the differing bits in one vectorized pass, so its
+        cost does not depend on the search radius. Tree indexes like a BK-tree visit a large part of their nodes at
+        the radii used for near-duplicates and end up slower than this scan.
+    """
+
+    def __init__(self, capacity=1024):
+        self.hashes = np.zeros(capacity, dtype=np.uint64)
+        self.keys = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, hash, key):
+        if len(self.keys) == len(self.hashes):
+            self.hashes = np.concatenate((self.hashes, np.zeros(len(self.hashes), dtype=np.uint64)))
+        self.hashes[len(self.keys)] = hash
+        self.keys.append(key)
+
+    def find(self, hash, max_distance):
+        """ Returns the key of the first indexed hash at most max_distance bits away from hash or None
+        """
+        distances = _popcount(self.hashes[:len(self.keys)] ^ np.uint64(hash))
+        matches = np.flatnonzero(distances <= max_distance)
+        if len(matches) == 0:
+            return None
+        return self.keys[matches[0]]
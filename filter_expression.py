@@ -0,0 +1,166 @@
+import ast
+import operator
+
+import numpy as np
+
+ANNOTATION_COLUMNS = ['num_keypoints', 'keypoint_cnt', 'iscrowd', 'area', 'bbox_x', 'bbox_y', 'bbox_w', 'bbox_h',
+                      'category_id']
+IMAGE_COLUMNS = ['width', 'height', 'person_cnt']
+
+BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+COMPARISON_OPERATORS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+}
+
+# levels of the values an expression works on
+SCALAR = 0
+IMAGE = 1
+ANNOTATION = 2
+
+
+class Columns:
+    """ Annotation and image fields as numpy arrays, the annotations of one image are stored next to each other
+    """
+
+    def __init__(self, images, id_to_annot):
+        self.image_ids = np.array(list(id_to_annot), dtype=np.int64)
+        annotations = [annot for id in id_to_annot for annot in id_to_annot[id]]
+        person_cnts = np.array([len(id_to_annot[id]) for id in id_to_annot], dtype=np.int64)
+        # index of the first annotation of every image and image index of every annotation
+        self.starts = np.concatenate(([0], np.cumsum(person_cnts)[:-1]))
+        self.annotation_image = np.repeat(np.arange(len(person_cnts)), person_cnts)
+
+        keypoints = np.array([annot['keypoints'] for annot in annotations], dtype=np.float64).reshape(
+            len(annotations), -1, 3)
+        bbox = np.array([annot['bbox'] for annot in annotations], dtype=np.float64).reshape(len(annotations), 4)
+        self.annotation_columns = {
+            'num_keypoints': np.array([annot.get('num_keypoints', 0) for annot in annotations], dtype=np.float64),
+            'keypoint_cnt': ((keypoints[:, :, 0] != 0) & (keypoints[:, :, 1] != 0)).sum(axis=1).astype(np.float64),
+            'iscrowd': np.array([annot['iscrowd'] for annot in annotations], dtype=np.float64),
+            'area': np.array([annot['area'] for annot in annotations], dtype=np.float64),
+            'bbox_x': bbox[:, 0],
+            'bbox_y': bbox[:, 1],
+            'bbox_w': bbox[:, 2],
+            'bbox_h': bbox[:, 3],
+            'category_id': np.array([annot['category_id'] for annot in annotations], dtype=np.float64),
+        }
+        self.image_columns = {
+            'width': np.array([images[id]['width'] for id in id_to_annot], dtype=np.float64),
+            'height': np.array([images[id]['height'] for id in id_to_annot], dtype=np.float64),
+            'person_cnt': person_cnts.astype(np.float64),
+        }
+
+
+def _lift(level, array, columns):
+    """ Broadcast an image level array to one value per annotation
+    """
+    if level == IMAGE:
+        return array[columns.annotation_image]
+    return array
+
+
+def _combine(operands, function):
+    """ Applies function to the values of the (level, evaluate) operands, on the highest level among them
+    """
+    level = max(operand[0] for operand in operands)
+    if level == ANNOTATION:
+        def evaluate(columns):
+            return function(*[_lift(operand[0], operand[1](columns), columns) for operand in operands])
+    else:
+        def evaluate(columns):
+            return function(*[operand[1](columns) for operand in operands])
+    return level, evaluate
+
+
+def _aggregate(name, operand):
+    level, argument = operand
+    if level != ANNOTATION:
+        raise ValueError(name + '() needs an expression over annotation fields')
+    if name == 'count':
+        return IMAGE, lambda columns: np.add.reduceat((argument(columns) != 0).astype(np.int64), columns.starts)
+    reduction = np.logical_and if name == 'all' else np.logical_or
+    return IMAGE, lambda columns: reduction.reduceat(argument(columns) != 0, columns.starts)
+
+
+def _compile(node):
+    """ Turns an expression node into (level, function of Columns returning an array)
+        The levels are known without data, so misplaced aggregates are reported while compiling
+    """
+    if isinstance(node, ast.Expression):
+        return _compile(node.body)
+
+    if isinstance(node, ast.Constant) and isinstance(node.value, (bool, int, float)):
+        value = np.float64(node.value)
+        return SCALAR, lambda columns: value
+
+    if isinstance(node, ast.Name):
+        name = node.id
+        if name in ANNOTATION_COLUMNS:
+            return ANNOTATION, lambda columns: columns.annotation_columns[name]
+        if name in IMAGE_COLUMNS:
+            return IMAGE, lambda columns: columns.image_columns[name]
+        raise ValueError('Unknown field: ' + name)
+
+    if isinstance(node, ast.BoolOp):
+        operands = [_compile(value) for value in node.values]
+        function = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+        result = operands[0]
+        for operand in operands[1:]:
+            result = _combine([result, operand], function)
+        return result
+
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.Not, ast.USub)):
+        function = np.logical_not if isinstance(node.op, ast.Not) else np.negative
+        return _combine([_compile(node.operand)], function)
+
+    if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+        return _combine([_compile(node.left), _compile(node.right)], BINARY_OPERATORS[type(node.op)])
+
+    if isinstance(node, ast.Compare) and all(type(op) in COMPARISON_OPERATORS for op in node.ops):
+        # a < b < c means a < b and b < c
+        operands = [_compile(operand) for operand in [node.left] + node.comparators]
+        functions = [COMPARISON_OPERATORS[type(op)] for op in node.ops]
+        result = _combine(operands[:2], functions[0])
+        for i in range(1, len(functions)):
+            result = _combine([result, _combine(operands[i:i + 2], functions[i])], np.logical_and)
+        return result
+
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in ('all', 'any', 'count') \
+            and len(node.args) == 1 and not node.keywords:
+        return _aggregate(node.func.id, _compile(node.args[0]))
+
+    raise ValueError('Unsupported expression: ' + ast.dump(node))
+
+
+def compile_expression(text):
+    """ Compiles a filter expression into a function of Columns returning one boolean per image
+
+        The expression uses python syntax over the fields in ANNOTATION_COLUMNS and IMAGE_COLUMNS, e.g.
+        'num_keypoints >= 12 and bbox_h / height > 0.3 and not iscrowd'. all(), any() and count() aggregate an
+        expression over the annotations of an image. An expression which still depends on single annotations
+        selects an image only if it holds for all of its annotations.
+        Raises SyntaxError or ValueError for expressions which can not be evaluated.
+    """
+    level, expression = _compile(ast.parse(text, mode='eval'))
+    if level == ANNOTATION:
+        level, expression = _aggregate('all', (level, expression))
+
+    def evaluate(columns):
+        array = expression(columns)
+        if level == SCALAR:
+            return np.full(len(columns.image_ids), bool(array))
+        return array != 0
+    return evaluate
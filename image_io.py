@@ -0,0 +1,138 @@
+import collections
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+
+def valid_resolution(width, height, output_stride=16):
+    target_width = (int(width) // output_stride) * output_stride + 1
+    target_height = (int(height) // output_stride) * output_stride + 1
+    return target_width, target_height
+
+
+JPEG_SOI = b'\xff\xd8'
+JPEG_EOI = b'\xff\xd9'
+# start of frame markers, they hold the image size
+JPEG_SOF_MARKERS = {0xc0, 0xc1, 0xc2, 0xc3, 0xc5, 0xc6, 0xc7, 0xc9, 0xca, 0xcb, 0xcd, 0xce, 0xcf}
+JPEG_SOS = 0xda
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_IEND = b'\x00\x00\x00\x00IEND\xaeB`\x82'
+
+
+def _jpeg_size(file):
+    """ Walks the marker segments up to the start of frame, returns (width, height) or None
+    """
+    file.seek(2)
+    while True:
+        marker = file.read(2)
+        if len(marker) < 2 or marker[0] != 0xff:
+            return None
+        while marker[1] == 0xff:
+            marker = marker[1:] + file.read(1)
+            if len(marker) < 2:
+                return None
+        if marker[1] == JPEG_SOS:
+            return None
+        length_data = file.read(2)
+        if len(length_data) < 2:
+            return None
+        length = struct.unpack('>H', length_data)[0]
+        if marker[1] in JPEG_SOF_MARKERS:
+            frame = file.read(5)
+            if len(frame) < 5:
+                return None
+            height, width = struct.unpack('>HH', frame[1:5])
+            return width, height
+        file.seek(length - 2, os.SEEK_CUR)
+
+
+def check_image_file(path, width=None, height=None):
+    """ Checks signature, end marker and header size of a JPEG or PNG file with a few small reads, no decoding
+        Returns None for a valid file, otherwise the reason why it is considered corrupt
+    """
+    if not os.path.exists(path):
+        return 'missing'
+    file_size = os.path.getsize(path)
+    with open(path, 'rb') as file:
+        signature = file.read(8)
+        if signature.startswith(JPEG_SOI):
+            size = _jpeg_size(file)
+            file.seek(max(0, file_size - 32))
+            # encoders may pad the file after the end of image marker
+            if JPEG_EOI not in file.read():
+                return 'truncated'
+        elif signature == PNG_SIGNATURE:
+            header = file.read(16)
+            size = struct.unpack('>II', header[8:16]) if len(header) == 16 and header[4:8] == b'IHDR' else None
+            file.seek(max(0, file_size - len(PNG_IEND)))
+            if file.read() != PNG_IEND:
+                return 'truncated'
+        else:
+            return 'unknown format'
+
+    if size is None:
+        return 'invalid header'
+    if width is not None and height is not None and size != (width, height):
+        return 'size mismatch'
+    return None
+
+
+def read_file(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def decode_image(data):
+    """ Decodes raw image file bytes to a BGR image like cv2.imread, returns None if they can not be decoded
+        Unlike cv2.imread, which returns the decoded part of a truncated JPEG, a truncated file gives None
+    """
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+class ImagePrefetcher:
+    """ Reads the raw bytes of the next image files in a thread pool while the caller decodes the current one
+
+        Iterating yields the file contents in the order of the given paths. At most queue_depth files are read
+        ahead and reading ahead pauses while the already read but not yet consumed files exceed max_buffer_mb.
+    """
+
+    def __init__(self, paths, queue_depth=16, max_buffer_mb=256):
+        self.paths = iter(paths)
+        self.queue_depth = max(1, int(queue_depth))
+        self.max_buffer_bytes = int(max_buffer_mb) * 1024 * 1024
+        self.executor = ThreadPoolExecutor(max_workers=self.queue_depth)
+        self.pending = collections.deque()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        self._fill()
+        while self.pending:
+            data = self.pending.popleft().result()
+            self._fill()
+            yield data
+
+    def _buffered_bytes(self):
+        return sum(len(future.result()) for future in self.pending if future.done() and not future.exception())
+
+    def _fill(self):
+        while len(self.pending) < self.queue_depth:
+            if self.pending and self._buffered_bytes() >= self.max_buffer_bytes:
+                return
+            path = next(self.paths, None)
+            if path is None:
+                return
+            self.pending.append(self.executor.submit(read_file, path))
+
+    def close(self):
+        for future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.executor.shutdown(wait=True)
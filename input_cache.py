@@ -0,0 +1,143 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from image_io import decode_image, read_file, valid_resolution
+
+INPUTS_FILE_NAME = 'inputs.npy'
+INDEX_FILE_NAME = 'index.npy'
+META_FILE_NAME = 'meta.json'
+INDEX_DTYPE = np.dtype([('image_id', np.int64), ('offset', np.int64), ('height', np.int32), ('width', np.int32),
+                        ('scale_y', np.float64), ('scale_x', np.float64)])
+
+
+def input_size(width, height, scale_factor=1.0, output_stride=16):
+    return valid_resolution(width * scale_factor, height * scale_factor, output_stride=output_stride)
+
+
+def normalize(input_img):
+    """ Maps RGB values from [0, 255] to [-1, 1] like the network expects
+    """
+    return input_img.astype(np.float32) * (2.0 / 255.0) - 1.0
+
+
+def process_input(source_img, scale_factor=1.0, output_stride=16):
+    """ Same preprocessing as _process_input in debricated/4_annotate_image.py, but the result is returned as an
+        (height, width, 3) RGB array which is not normalized yet
+    """
+    target_width, target_height = input_size(source_img.shape[1], source_img.shape[0], scale_factor, output_stride)
+    scale = np.array([source_img.shape[0] / target_height, source_img.shape[1] / target_width])
+
+    input_img = cv2.resize(source_img, (target_width, target_height), interpolation=cv2.INTER_LINEAR)
+    input_img = cv2.cvtColor(input_img, cv2.COLOR_BGR2RGB)
+    return input_img, scale
+
+
+def build_input_cache(images, image_path, folder, scale_factor=1.0, output_stride=16, dtype='float16',
+                      workers=os.cpu_count(), load_image_data=None):
+    """ Preprocesses every image entry (id, file_name, width, height of a coco json) once and stores the results
+        back to back in one memory-mapped array
+
+        The target sizes follow from width and height of the entries, so the array is allocated up front and the
+        workers write their images directly into their part of it. load_image_data(image) returns the raw image
+        file bytes, by default the file is read from image_path.
+    """
+    if load_image_data is None:
+        def load_image_data(image):
+            return read_file(os.path.join(image_path, image['file_name']))
+
+    if not os.path.exists(folder):
+        os.mkdir(folder)
+
+    index = np.zeros(len(images), dtype=INDEX_DTYPE)
+    offset = 0
+    for i, image in enumerate(images):
+        width, height = input_size(image['width'], image['height'], scale_factor, output_stride)
+        index[i] = (image['id'], offset, height, width, 0, 0)
+        offset += height * width * 3
+
+    inputs = open_memmap(os.path.join(folder, INPUTS_FILE_NAME), mode='w+', dtype=np.dtype(dtype),
+                         shape=(offset,))
+
+    def process(i):
+        source_img = decode_image(load_image_data(images[i]))
+        if source_img is None or source_img.shape[:2] != (images[i]['height'], images[i]['width']):
+            raise ValueError('Image does not match its json entry: ' + str(images[i]['file_name']))
+        input_img, scale = process_input(source_img, scale_factor, output_stride)
+        if inputs.dtype != np.uint8:
+            input_img = normalize(input_img)
+        start = index['offset'][i]
+        inputs[start:start + input_img.size] = input_img.reshape(-1)
+        index['scale_y'][i], index['scale_x'][i] = scale
+
+    cnt = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in executor.map(process, range(len(images))):
+            cnt += 1
+            if cnt % 500 == 0:
+                print(str(cnt) + " images preprocessed")
+    print(str(cnt) + " images preprocessed")
+
+    inputs.flush()
+    del inputs
+    index.sort(order='image_id')
+    np.save(os.path.join(folder, INDEX_FILE_NAME), index)
+    with open(os.path.join(folder, META_FILE_NAME), 'w') as meta_file:
+        json.dump({'scale_factor': scale_factor, 'output_stride': output_stride, 'dtype': str(np.dtype(dtype))},
+                  meta_file)
+
+
+class InputCache:
+    """ Reads network inputs written by build_input_cache without decoding or copying them
+
+        input_img returns a (1, height, width, 3) view into the memory-mapped array, in the stored dtype.
+        network_input returns float32 values in [-1, 1] and the scale, like read_imgfile did.
+    """
+
+    def __init__(self, folder):
+        with open(os.path.join(folder, META_FILE_NAME)) as meta_file:
+            self.meta = json.load(meta_file)
+        self.index = np.load(os.path.join(folder, INDEX_FILE_NAME), mmap_mode='r')
+        self.inputs = np.load(os.path.join(folder, INPUTS_FILE_NAME), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, image_id):
+        return self._position(image_id) is not None
+
+    def __iter__(self):
+        for image_id in self.index['image_id']:
+            yield int(image_id)
+
+    def _position(self, image_id):
+        position = int(np.searchsorted(self.index['image_id'], image_id))
+        if position < len(self.index) and self.index['image_id'][position] == image_id:
+            return position
+        return None
+
+    def _entry(self, image_id):
+        position = self._position(image_id)
+        if position is None:
+            raise KeyError(image_id)
+        return self.index[position]
+
+    def input_img(self, image_id):
+        entry = self._entry(image_id)
+        height, width = int(entry['height']), int(entry['width'])
+        start = int(entry['offset'])
+        return self.inputs[start:start + height * width * 3].reshape(1, height, width, 3)
+
+    def scale(self, image_id):
+        entry = self._entry(image_id)
+        return np.array([entry['scale_y'], entry['scale_x']])
+
+    def network_input(self, image_id):
+        input_img = self.input_img(image_id)
+        if input_img.dtype == np.uint8:
+            input_img = normalize(input_img)
+        return input_img.astype(np.float32, copy=False), self.scale(image_id)
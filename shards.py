@@ -0,0 +1,125 @@
+import json
+import mmap
+import os
+
+import numpy as np
+
+INDEX_FILE_NAME = 'index.npy'
+INDEX_DTYPE = np.dtype([('image_id', np.int64), ('shard', np.int32), ('offset', np.int64),
+                        ('image_size', np.int64), ('annotations_size', np.int64)])
+
+
+def shard_file_name(shard):
+    return 'shard-%05d.bin' % shard
+
+
+class ShardWriter:
+    """ Packs images and their annotations into a few large shard files instead of one file per image
+
+        Every record is the raw image file followed by its annotations as json. A new shard is started once the
+        current one exceeds max_shard_mb. close() writes index.npy, a numpy array sorted by image id which holds
+        shard, offset and sizes of every record.
+    """
+
+    def __init__(self, folder, max_shard_mb=1024):
+        self.folder = folder
+        self.max_shard_bytes = int(max_shard_mb) * 1024 * 1024
+        self.entries = []
+        self.shard = -1
+        self.shard_file = None
+        if not os.path.exists(self.folder):
+            os.mkdir(self.folder)
+        self._next_shard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _next_shard(self):
+        if self.shard_file is not None:
+            self.shard_file.close()
+        self.shard += 1
+        self.shard_file = open(os.path.join(self.folder, shard_file_name(self.shard)), 'wb')
+        self.offset = 0
+
+    def add(self, image_id, image_data, annotations):
+        if self.offset > 0 and self.offset >= self.max_shard_bytes:
+            self._next_shard()
+
+        annotations_data = json.dumps(annotations).encode()
+        self.shard_file.write(image_data)
+        self.shard_file.write(annotations_data)
+        self.entries.append((image_id, self.shard, self.offset, len(image_data), len(annotations_data)))
+        self.offset += len(image_data) + len(annotations_data)
+
+    def close(self):
+        if self.shard_file is None:
+            return
+        self.shard_file.close()
+        self.shard_file = None
+
+        index = np.array(self.entries, dtype=INDEX_DTYPE)
+        index.sort(order='image_id')
+        np.save(os.path.join(self.folder, INDEX_FILE_NAME), index)
+
+
+class ShardReader:
+    """ Random access by image id into shards written by ShardWriter
+
+        The index and the shard files are memory-mapped, a lookup is a binary search over the index followed by a
+        slice of the shard. Iterating yields the image ids in the order they are stored, i.e. sequential reads.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.index = np.load(os.path.join(folder, INDEX_FILE_NAME), mmap_mode='r')
+        self.shards = dict()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, image_id):
+        return self._position(image_id) is not None
+
+    def __iter__(self):
+        order = np.lexsort((self.index['offset'], self.index['shard']))
+        for position in order:
+            yield int(self.index['image_id'][position])
+
+    def _position(self, image_id):
+        position = int(np.searchsorted(self.index['image_id'], image_id))
+        if position < len(self.index) and self.index['image_id'][position] == image_id:
+            return position
+        return None
+
+    def _shard(self, shard):
+        if shard not in self.shards:
+            with open(os.path.join(self.folder, shard_file_name(shard)), 'rb') as shard_file:
+                self.shards[shard] = mmap.mmap(shard_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.shards[shard]
+
+    def _entry(self, image_id):
+        position = self._position(image_id)
+        if position is None:
+            raise KeyError(image_id)
+        entry = self.index[position]
+        return self._shard(int(entry['shard'])), int(entry['offset']), int(entry['image_size']), \
+            int(entry['annotations_size'])
+
+    def image_data(self, image_id):
+        """ Raw image file bytes, decode them with image_io.decode_image
+        """
+        shard, offset, image_size, annotations_size = self._entry(image_id)
+        return shard[offset:offset + image_size]
+
+    def annotations(self, image_id):
+        shard, offset, image_size, annotations_size = self._entry(image_id)
+        start = offset + image_size
+        return json.loads(shard[start:start + annotations_size])
+
+    def close(self):
+        for shard in self.shards.values():
+            shard.close()
+        self.shards.clear()